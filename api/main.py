@@ -1,24 +1,39 @@
 import asyncio
 import io
+import itertools
 import logging
+import math
 import os
+import shutil
+import tempfile
+import threading
 import time
-import uuid
-from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, List
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
 
+import av
 import cv2
 import numpy as np
 import torch
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import FastAPI, File, HTTPException, Query, UploadFile
+from fastapi.background import BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from PIL import Image
+from PIL import Image, ImageOps
 from prometheus_client import Counter, Histogram, generate_latest
 
+from src.inference.device import supports_fp16
+from src.models.export import exported_build
+
+try:
+    import ffmpegcv
+except ImportError:  # NVDEC decoding is optional
+    ffmpegcv = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,7 +43,29 @@ prediction_counter = Counter("predictions_total", "Total predictions made")
 prediction_latency = Histogram("prediction_latency_seconds", "Prediction latency")
 model_errors = Counter("model_errors_total", "Total model errors")
 
-app = FastAPI(title="Object Detection API", version="1.0.0")
+EXIF_ORIENTATION = 0x0112
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build one warmed-up detector per process instead of at import time"""
+    detector = ObjectDetector(
+        model_path="src/models/best.pt",
+        device="cuda" if torch.cuda.is_available() else "cpu",
+        # Exported builds need TensorRT/OpenVINO, which the image doesn't ship
+        use_exported=os.getenv("USE_EXPORTED_MODEL", "0") == "1",
+    )
+    await asyncio.to_thread(detector.warmup)
+    app.state.detector = detector
+    yield
+
+
+app = FastAPI(
+    title="Object Detection API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # CORS middleware
 app.add_middleware(
@@ -43,58 +80,191 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
 class ObjectDetector:
-    def __init__(self, model_path: str, device: str = "cpu"):
+    def __init__(
+        self,
+        model_path: str,
+        device: str = "cpu",
+        imgsz: int = 640,
+        use_exported: bool = False,
+    ):
         self.device = device
-        self.model = self.load_model(model_path)
-        self.executor = ThreadPoolExecutor(max_workers=4)
-
-    def load_model(self, model_path: str):
-        """Load YOLOv11 model"""
+        self.imgsz = imgsz
+        self.half = supports_fp16(device)
+        self.model = self.load_model(model_path, use_exported)
+        # Ultralytics' predictor keeps per-call state (dataset, batch, results),
+        # so calls from the to_thread pool must not overlap
+        self._model_lock = threading.Lock()
+
+    def load_model(self, model_path: str, use_exported: bool = False):
+        """Load YOLOv11 model, or an exported TensorRT/OpenVINO build if asked to"""
         from ultralytics import YOLO
 
+        exported_path = None
+        if use_exported:
+            exported_path = exported_build(Path(model_path), self.device)
+        if exported_path is not None:
+            try:
+                # Ultralytics dispatches to the matching runtime from the suffix
+                model = YOLO(str(exported_path), task="detect")
+                # The runtime only loads on the first call, so probe it here
+                dummy = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+                model(dummy, half=self.half, verbose=False)
+                logger.info(f"Exported model {exported_path} loaded on {self.device}")
+                # Exported builds are static batch-1 graphs
+                self.dynamic_batch = False
+                return model
+            except Exception as e:
+                logger.warning(f"Could not load {exported_path}, using weights: {e}")
+
         model = YOLO(model_path)
         model.to(self.device)
         logger.info(f"Model loaded on {self.device}")
+        self.dynamic_batch = True
         return model
 
+    def warmup(self, iterations: int = 3):
+        """Run dummy inferences so lazy setup and kernel selection happen up front"""
+        if self.device.startswith("cuda"):
+            # Rect letterboxing yields a handful of shapes (one per aspect ratio),
+            # and cuDNN caches its pick for each
+            torch.backends.cudnn.benchmark = True
+
+        dummy = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        for _ in range(iterations):
+            self._run_inference(dummy)
+        logger.info(f"Model warmed up with {iterations} {self.imgsz}px passes")
+
     @prediction_latency.time()
-    async def predict(self, image: np.ndarray) -> Dict:
+    async def predict(
+        self,
+        image: Union[np.ndarray, torch.Tensor],
+        orig_shape: Optional[Tuple[int, int]] = None,
+    ) -> Dict:
         """Run inference on image"""
         prediction_counter.inc()
 
         try:
-            # Run inference in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            results = await loop.run_in_executor(
-                self.executor, self._run_inference, image
+            # Run inference in a worker thread to avoid blocking
+            results = await asyncio.to_thread(self._run_inference, image)
+
+            if isinstance(image, torch.Tensor):
+                input_shape = image.shape[1:]
+            else:
+                input_shape = image.shape[:2]
+            return self._process_results(
+                results, self._box_gain(input_shape, orig_shape)
             )
 
-            return self._process_results(results)
-
         except Exception as e:
             model_errors.inc()
             logger.error(f"Prediction error: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
 
-    def _run_inference(self, image: np.ndarray):
-        """Actual inference logic"""
-        return self.model(image)
+    async def predict_batch(
+        self,
+        images: List[np.ndarray],
+        orig_shapes: Optional[List[Tuple[int, int]]] = None,
+    ) -> List[Dict]:
+        """Run inference on several images, batched when the backend allows it"""
+        prediction_counter.inc(len(images))
+
+        try:
+            results = await asyncio.to_thread(self._run_inference, images)
+
+            if orig_shapes is None:
+                orig_shapes = [None] * len(images)
+            return [
+                self._process_results([r], self._box_gain(im.shape[:2], shape))
+                for r, im, shape in zip(results, images, orig_shapes)
+            ]
+
+        except Exception as e:
+            model_errors.inc()
+            logger.error(f"Batch prediction error: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
 
-    def _process_results(self, results) -> Dict:
+    def _run_inference(self, image: Union[np.ndarray, List[np.ndarray], torch.Tensor]):
+        """Actual inference logic"""
+        # Cheaper than Ultralytics' no_grad: also skips autograd version counters
+        with self._model_lock, torch.inference_mode():
+            if not isinstance(image, list):
+                return self._run_single_inference(image)
+            if self.dynamic_batch:
+                return self.model(image, half=self.half)
+            # A batch-1 export rejects stacked input, so go one image at a time
+            return [r for im in image for r in self._run_single_inference(im)]
+
+    def _run_single_inference(self, image: Union[np.ndarray, torch.Tensor]):
+        """Run one image through the device-frame or plain Ultralytics path"""
+        if isinstance(image, torch.Tensor):
+            return self._run_device_inference(image)
+        # Ultralytics letterboxes to the smallest stride-multiple rectangle
+        return self.model(image, half=self.half)
+
+    def _run_device_inference(self, frame: torch.Tensor):
+        """Letterbox an RGB CHW frame already resized to fit imgsz in device memory"""
+        from ultralytics.utils import ops
+
+        h, w = frame.shape[1:]
+        if self.dynamic_batch:
+            # Pad only to the next stride multiple, like Ultralytics' rect letterbox
+            stride = int(self.model.model.stride.max())
+            out_h = math.ceil(h / stride) * stride
+            out_w = math.ceil(w / stride) * stride
+        else:
+            # Exported builds take a fixed imgsz x imgsz input
+            out_h = out_w = self.imgsz
+        # Centred grey padding with LetterBox's rounding, done on the GPU
+        dh, dw = (out_h - h) / 2, (out_w - w) / 2
+        top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+        left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+
+        x = frame[None].half() if self.half else frame[None].float()
+        x = torch.nn.functional.pad(x, (left, right, top, bottom), value=114)
+        # Decode and resize stay on the GPU, but Ultralytics still copies the
+        # input back to the host once for Results.orig_img
+        results = self.model(x / 255, half=self.half)
+
+        # Boxes come back in letterbox coordinates; map them onto the frame
+        for r in results:
+            if r.boxes is not None:
+                ops.scale_boxes(x.shape[2:], r.boxes.data[:, :4], (h, w))
+        return results
+
+    @staticmethod
+    def _box_gain(input_shape, orig_shape) -> Optional[np.ndarray]:
+        """Per-axis xyxy scale from the inferred image back to the original one"""
+        if orig_shape is None or tuple(input_shape) == tuple(orig_shape):
+            return None
+        gain_y = orig_shape[0] / input_shape[0]
+        gain_x = orig_shape[1] / input_shape[1]
+        return np.array([gain_x, gain_y, gain_x, gain_y], dtype=np.float32)
+
+    def _process_results(self, results, gain: Optional[np.ndarray] = None) -> Dict:
         """Process YOLO results to JSON format"""
         detections = []
+        names = self.model.names
 
         for r in results:
             boxes = r.boxes
             if boxes is not None:
-                for box in boxes:
-                    detection = {
-                        "bbox": box.xyxy[0].tolist(),
-                        "confidence": float(box.conf[0]),
-                        "class": int(box.cls[0]),
-                        "class_name": self.model.names[int(box.cls[0])],
+                # One device->host copy per tensor instead of several per box;
+                # bbox rows stay numpy since orjson serializes arrays natively
+                xyxy = boxes.xyxy.cpu().numpy()
+                if gain is not None:
+                    # The image was decoded or resized smaller than the original
+                    xyxy = xyxy * gain
+                conf = boxes.conf.cpu().numpy().tolist()
+                cls = boxes.cls.cpu().numpy().astype(int).tolist()
+                detections.extend(
+                    {
+                        "bbox": bbox,
+                        "confidence": score,
+                        "class": class_id,
+                        "class_name": names[class_id],
                     }
-                    detections.append(detection)
+                    for bbox, score, class_id in zip(xyxy, conf, cls)
+                )
 
         return {
             "detections": detections,
@@ -103,64 +273,162 @@ class ObjectDetector:
         }
 
 
-# Initialize model
-detector = ObjectDetector(
-    model_path="src/models/best.pt",
-    device="cuda" if torch.cuda.is_available() else "cpu",
-)
+def _decode_image(buf: bytes, imgsz: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """Decode uploaded image bytes into a BGR array and the full-size (h, w)"""
+    with Image.open(io.BytesIO(buf)) as img:
+        if img.format == "JPEG":
+            width, height = img.size
+            # libjpeg decodes straight at the smallest 1/2, 1/4 or 1/8 scale that
+            # still covers imgsz, far cheaper than decoding a 4K upload in full
+            img.draft("RGB", (imgsz, imgsz))
+            if img.size != (width, height):
+                # Honour EXIF orientation the way cv2.imdecode does below
+                if img.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+                    width, height = height, width
+                rgb = ImageOps.exif_transpose(img.convert("RGB"))
+                image = cv2.cvtColor(np.asarray(rgb), cv2.COLOR_RGB2BGR)
+                return image, (height, width)
+
+    image = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode uploaded image")
+    return image, image.shape[:2]
+
+
+def _letterbox_size(shape: Tuple[int, int], imgsz: int) -> Tuple[int, int]:
+    """(w, h) that fits an (h, w) frame inside imgsz without changing its aspect"""
+    r = min(imgsz / shape[0], imgsz / shape[1])
+    w, h = int(round(shape[1] * r)), int(round(shape[0] * r))
+    # NV12 subsamples chroma 2x2, so NVDEC needs even dimensions
+    return w - w % 2, h - h % 2
+
+
+def _nvdec_frames(nvdec):
+    """Yield float32 0-255 RGB CHW CUDA tensors from an ffmpegcv CUDA reader"""
+    while True:
+        # Plain iteration yields pycuda GPUArrays, which torch can't consume
+        ret, frame = nvdec.read_torch()
+        if not ret:
+            return
+        yield frame
+
+
+def _open_nvdec(filename: str, size: Tuple[int, int]):
+    """Open an NVDEC reader yielding CUDA CHW frames, or None if unavailable"""
+    try:
+        # Aspect-preserving resize only; padding to imgsz happens on the GPU
+        return ffmpegcv.toCUDA(
+            ffmpegcv.VideoCaptureNV(
+                filename, pix_fmt="nv12", resize=size, resize_keepratio=False
+            ),
+            tensor_format="chw",
+        )
+    except Exception as e:
+        logger.warning(f"NVDEC unavailable, decoding on CPU: {e}")
+        return None
 
 
 @app.get("/health")
-async def health_check():
+async def health_check(request: Request):
     """Health check endpoint"""
+    detector = request.app.state.detector
     return {"status": "healthy", "device": detector.device}
 
 
 @app.post("/api/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(request: Request, file: UploadFile = File(...)):
     start_time = time.time()
+    detector = request.app.state.detector
     try:
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        image_np = np.array(image)
-        results = await detector.predict(image_np)
+        image_np, orig_shape = await asyncio.to_thread(
+            _decode_image, contents, detector.imgsz
+        )
+        results = await detector.predict(image_np, orig_shape)
         results["processing_time_ms"] = (time.time() - start_time) * 1000
-        results["image_size"] = image.size
-        return JSONResponse(content=results)
+        results["image_size"] = [orig_shape[1], orig_shape[0]]
+        return ORJSONResponse(content=results)
     except Exception as e:
         logger.exception("Error in /predict")
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+        return ORJSONResponse(content={"error": str(e)}, status_code=500)
 
 
 @app.post("/api/predict_video")
-async def predict_video(file: UploadFile = File(...)):
-    # Create unique temp file
-    temp_filename = f"temp_{uuid.uuid4().hex}.mp4"
-
-    # Save uploaded video
-    contents = await file.read()
-    with open(temp_filename, "wb") as f:
-        f.write(contents)
-
-    cap = cv2.VideoCapture(temp_filename)
-    # ✨ GET THE REAL FPS FROM THE VIDEO FILE
-    fps = cap.get(cv2.CAP_PROP_FPS)
-
+async def predict_video(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    stride: int = Query(1, ge=1, description="Run detection on every Nth frame"),
+):
+    detector = request.app.state.detector
     video_detections = []
+    tmp_path = None
+    nvdec = None
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        results = await detector.predict(frame)
-        video_detections.append(results["detections"])
-
-    cap.release()
-    os.remove(temp_filename)
-
-    # ✨ SEND THE FPS BACK TO THE FRONTEND
-    return JSONResponse(content={"video_detections": video_detections, "fps": fps})
+    try:
+        if ffmpegcv is not None and detector.device.startswith("cuda"):
+            # NVDEC reads from a path, so only the GPU decode path touches disk
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp:
+                tmp_path = tmp.name
+                # A disk-to-disk copy of the whole upload; keep it off the loop
+                await asyncio.to_thread(shutil.copyfileobj, file.file, tmp)
+            file.file.seek(0)
+
+        # Starlette has already spooled the upload; PyAV reads it in place.
+        # Probing the container reads from disk, so it runs off the event loop
+        try:
+            container = await asyncio.to_thread(av.open, file.file)
+        except av.error.FFmpegError as e:
+            raise HTTPException(status_code=400, detail=f"Unreadable video: {e}")
+        with container:
+            if not container.streams.video:
+                raise HTTPException(status_code=400, detail="No video stream found")
+            stream = container.streams.video[0]
+            # ✨ GET THE REAL FPS FROM THE VIDEO FILE
+            fps = float(stream.average_rate or 0)
+            orig_shape = (stream.codec_context.height, stream.codec_context.width)
+
+            if tmp_path is not None:
+                # Decode on the GPU so frames land in device memory
+                # ffmpegcv probes the file and FFmpeg's codecs in subprocesses
+                nvdec = await asyncio.to_thread(
+                    _open_nvdec, tmp_path, _letterbox_size(orig_shape, detector.imgsz)
+                )
+
+            if nvdec is not None:
+                frames = itertools.islice(_nvdec_frames(nvdec), 0, None, stride)
+            else:
+                # FFmpeg decodes on its own threads and PyAV releases the GIL
+                stream.thread_type = "AUTO"
+                # Skipped frames are decoded (later frames reference them) but
+                # never converted to BGR or run through the model
+                frames = (
+                    f.to_ndarray(format="bgr24")
+                    for i, f in enumerate(container.decode(stream))
+                    if i % stride == 0
+                )
+
+            # Pull each frame in a worker thread: decoding and the BGR conversion
+            # would otherwise block every other request on the event loop
+            while (frame := await asyncio.to_thread(next, frames, None)) is not None:
+                results = await detector.predict(frame, orig_shape)
+                video_detections.append(results["detections"])
+    except BaseException:
+        # No response goes out, so a background unlink would never run
+        if tmp_path is not None:
+            os.unlink(tmp_path)
+        raise
+    finally:
+        if nvdec is not None:
+            nvdec.release()
+
+    if tmp_path is not None:
+        # Unlinked after the response is sent rather than inside the request
+        background_tasks.add_task(os.unlink, tmp_path)
+
+    # ✨ SEND THE FPS BACK TO THE FRONTEND (one detection list per `stride` frames)
+    fps /= stride
+    return ORJSONResponse(content={"video_detections": video_detections, "fps": fps})
 
 
 @app.get("/metrics")
@@ -170,22 +438,24 @@ async def metrics():
 
 
 @app.post("/api/batch_predict")
-async def batch_predict(files: List[UploadFile] = File(...)):
+async def batch_predict(request: Request, files: List[UploadFile] = File(...)):
     """Batch prediction endpoint"""
+    detector = request.app.state.detector
     if len(files) > 10:
         raise HTTPException(status_code=400, detail="Maximum 10 images per batch")
 
-    results = []
-    for file in files:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        image_np = np.array(image)
+    contents = await asyncio.gather(*(file.read() for file in files))
+    decoded = await asyncio.gather(
+        *(asyncio.to_thread(_decode_image, buf, detector.imgsz) for buf in contents)
+    )
+    images, orig_shapes = zip(*decoded)
 
-        result = await detector.predict(image_np)
+    # With .pt weights Ultralytics stacks the list into one NCHW batch
+    results = await detector.predict_batch(list(images), list(orig_shapes))
+    for file, result in zip(files, results):
         result["filename"] = file.filename
-        results.append(result)
 
-    return JSONResponse(content={"results": results})
+    return ORJSONResponse(content={"results": results})
 
 
 templates = Jinja2Templates(directory="static")
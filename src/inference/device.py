@@ -0,0 +1,11 @@
+import torch
+
+
+def supports_fp16(device: str) -> bool:
+    """Whether FP16 inference is worth it on device"""
+    # FP16 only pays off on tensor-core GPUs (Volta+); Pascal runs it slower
+    return (
+        device.startswith("cuda")
+        and torch.cuda.is_available()
+        and torch.cuda.get_device_capability(device)[0] >= 7
+    )
@@ -1,26 +1,37 @@
+import av
 import cv2
+import numpy as np
 from ultralytics import YOLO
 
+from src.inference.device import supports_fp16
+
+try:
+    import ffmpegcv
+except ImportError:  # NVENC encoding is optional
+    ffmpegcv = None
+
 
 class YoloPredictor:
     def __init__(self, model_path: str, device: str = "cuda"):
         self.model = YOLO(model_path)
         self.device = device
+        self.half = supports_fp16(device)
 
     def predict_image(self, image_path: str, conf: float = 0.25):
         image = cv2.imread(image_path)
         if image is None:
             raise FileNotFoundError(f"Could not load image: {image_path}")
 
-        results = self.model(image, device=self.device, conf=conf)
+        results = self.model(image, device=self.device, conf=conf, half=self.half)
         boxes = results[0].boxes.xyxy.cpu().numpy()
         scores = results[0].boxes.conf.cpu().numpy()
         classes = results[0].boxes.cls.cpu().numpy()
         names = results[0].names
 
-        for box, score, cls_idx in zip(boxes, scores, classes):
-            x1, y1, x2, y2 = [int(v) for v in box]
-            label = names[int(cls_idx)]
+        for (x1, y1, x2, y2), score, cls_idx in zip(
+            boxes.astype(np.int32).tolist(), scores, classes.astype(int).tolist()
+        ):
+            label = names[cls_idx]
             cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
             cv2.putText(
                 image,
@@ -33,62 +44,91 @@ class YoloPredictor:
             )
         return boxes, scores, classes, image
 
-    def predict_video(self, video_path: str, conf: float = 0.25, save_path: str = None):
-        cap = cv2.VideoCapture(video_path)
-        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
+    def predict_video(
+        self,
+        video_path: str,
+        conf: float = 0.25,
+        save_path: str = None,
+        show: bool = False,
+        draw: bool = False,
+    ):
+        container = av.open(video_path)
+        stream = container.streams.video[0]
+        # Threaded FFmpeg decode; PyAV releases the GIL while it runs
+        stream.thread_type = "AUTO"
+        w = stream.codec_context.width
+        h = stream.codec_context.height
+        fps = float(stream.average_rate or 0)
+        # Saved and displayed videos are annotated; detections-only runs skip it
+        draw = draw or show or bool(save_path)
 
         out = None
         if save_path:
-            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-            out = cv2.VideoWriter(save_path, fourcc, fps if fps > 0 else 20.0, (w, h))
-
-        frame_count = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            results = self.model(frame, device=self.device, conf=conf)[0]
-
-            # Draw bounding boxes and labels
-            for box, cls, score in zip(
-                results.boxes.xyxy, results.boxes.cls, results.boxes.conf
-            ):
-                x1, y1, x2, y2 = map(int, box)
-                class_id = int(cls)
-                conf_score = float(score)
-                label = f"{self.model.names[class_id]} {conf_score:.2f}"
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(
-                    frame,
-                    label,
-                    (x1, y1 - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.6,
-                    (0, 255, 0),
-                    2,
-                )
-
-            cv2.imshow("Detections", frame)
+            fps = fps if fps > 0 else 20.0
+            if ffmpegcv is not None and self.device.startswith("cuda"):
+                try:
+                    # Hardware H.264 on NVENC instead of software MPEG-4 Part 2
+                    out = ffmpegcv.VideoWriterNV(save_path, "h264", fps)
+                except Exception as e:
+                    # No ffmpeg binary, or one built without NVENC
+                    print(f"⚠️ NVENC unavailable, encoding on CPU: {e}")
+            if out is None:
+                fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+                out = cv2.VideoWriter(save_path, fourcc, fps, (w, h))
+
+        # One (boxes, scores, classes) entry per frame
+        detections = []
+        for frame in container.decode(stream):
+            frame = frame.to_ndarray(format="bgr24")
+            results = self.model(frame, device=self.device, conf=conf, half=self.half)
+            results = results[0]
+
+            boxes = results.boxes.xyxy.cpu().numpy()
+            scores = results.boxes.conf.cpu().numpy()
+            classes = results.boxes.cls.cpu().numpy()
+            detections.append((boxes, scores, classes))
+
+            if draw:
+                self._draw_detections(frame, boxes, scores, classes)
             if out:
                 out.write(frame)
 
-            if cv2.waitKey(1) & 0xFF == ord("q"):
-                break
-
-            frame_count += 1
+            if show:
+                cv2.imshow("Detections", frame)
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
 
-        cap.release()
+        container.close()
         if out:
             out.release()
             print(f"✅ Video saved to {save_path}")
-        cv2.destroyAllWindows()
+        if show:
+            cv2.destroyAllWindows()
+        return detections
+
+    def _draw_detections(self, frame, boxes, scores, classes):
+        xyxy = boxes.astype(np.int32)
+        # Draw every box with one polylines call rather than a rectangle per box
+        corners = xyxy[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]
+        cv2.polylines(frame, list(corners), True, (0, 255, 0), 2)
+
+        for (x1, y1), class_id, conf_score in zip(
+            xyxy[:, :2].tolist(), classes.astype(int).tolist(), scores.tolist()
+        ):
+            cv2.putText(
+                frame,
+                f"{self.model.names[class_id]} {conf_score:.2f}",
+                (x1, y1 - 10),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.6,
+                (0, 255, 0),
+                2,
+            )
 
 
-# python predictor.py --input_path ../data/sample.jpg
-# python predictor.py --input_path ../data/video.mp4 --save_path pred.mp4
+# Run from the repository root:
+# python -m src.inference.predictor --input_path data/sample.jpg
+# python -m src.inference.predictor --input_path data/video.mp4 --save_path pred.mp4
 
 if __name__ == "__main__":
     import argparse
@@ -98,7 +138,7 @@ if __name__ == "__main__":
         "--input_path", required=True, help="Path to input image or video"
     )
     parser.add_argument(
-        "--model_path", default="../models/best.pt", help="Path to .pt model weights"
+        "--model_path", default="src/models/best.pt", help="Path to .pt model weights"
     )
     parser.add_argument(
         "--device", default="cuda", help="Device for inference ('cuda' or 'cpu')"
@@ -133,7 +173,9 @@ if __name__ == "__main__":
         cv2.destroyAllWindows()
 
     elif input_path.lower().endswith((".mp4", ".avi", ".mov", ".mkv")):
-        predictor.predict_video(input_path, conf=conf, save_path=save_path)
+        predictor.predict_video(
+            input_path, conf=conf, save_path=save_path, show=True, draw=True
+        )
 
     else:
         raise ValueError("Unsupported input file format.")
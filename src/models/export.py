@@ -0,0 +1,109 @@
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_digest(weights: Path) -> str:
+    """SHA-256 of a checkpoint, recorded beside every build exported from it"""
+    digest = hashlib.sha256()
+    with open(weights, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_path(weights: Path, fmt: str, int8: bool = False) -> Path:
+    """Where Ultralytics writes the fmt export of weights"""
+    if fmt == "engine":
+        return weights.with_suffix(".engine")
+    # OpenVINO exports are directories, prefixed when quantized
+    prefix = "int8_" if int8 else ""
+    return weights.with_name(f"{weights.stem}_{prefix}openvino_model")
+
+
+def _source_path(build: Path) -> Path:
+    # Sidecar holding the digest of the checkpoint the build came from; mtimes
+    # are meaningless after a git checkout or Docker COPY
+    return build.with_name(build.name + ".source")
+
+
+def _is_current(build: Path, digest: str) -> bool:
+    source = _source_path(build)
+    return build.exists() and source.exists() and source.read_text() == digest
+
+
+def exported_build(weights: Path, device: str) -> Optional[Path]:
+    """Return the exported build for device made from this exact checkpoint"""
+    if device.startswith("cuda"):
+        candidates = [build_path(weights, "engine")]
+    else:
+        candidates = [
+            build_path(weights, "openvino", int8=True),
+            build_path(weights, "openvino"),
+        ]
+
+    candidates = [c for c in candidates if c.exists()]
+    if not candidates or not weights.exists():
+        # Nothing to check an export against when only the export was shipped
+        return candidates[0] if candidates else None
+
+    digest = checkpoint_digest(weights)
+    for candidate in candidates:
+        if _is_current(candidate, digest):
+            return candidate
+        logger.warning(f"Ignoring {candidate}: not exported from {weights}")
+    return None
+
+
+def export_serving_builds(weights: Path, config: Dict) -> List[Path]:
+    """Export TensorRT (GPU) and OpenVINO (CPU) builds next to weights"""
+    from ultralytics import YOLO
+
+    export_cfg = config.get("export", {})
+    calib_data = config["data"]["yaml_path"]
+    device = config.get("device", 0)
+    if isinstance(device, (list, tuple)):
+        # TensorRT builds on a single GPU; use the first training device
+        device = device[0]
+    jobs = []
+
+    if torch.cuda.is_available() and not str(device).startswith("cpu"):
+        # FP16 engine by default; INT8 calibrates on the dataset's val split
+        int8 = export_cfg.get("int8", False)
+        jobs.append(
+            dict(
+                format="engine",
+                half=True,
+                int8=int8,
+                data=calib_data if int8 else None,
+                device=device,
+                workspace=export_cfg.get("workspace", 4),
+            )
+        )
+
+    if export_cfg.get("openvino", True):
+        jobs.append(dict(format="openvino", int8=True, data=calib_data))
+
+    digest = checkpoint_digest(weights)
+    model = YOLO(str(weights))
+    exported = []
+    for kwargs in jobs:
+        build = build_path(weights, kwargs["format"], kwargs["int8"])
+        if _is_current(build, digest):
+            exported.append(build)
+            continue
+        try:
+            build = Path(model.export(**kwargs))
+        except Exception as e:
+            # One failed runtime shouldn't cost the other builds
+            logger.warning(f"{kwargs['format']} export of {weights} failed: {e}")
+            continue
+        _source_path(build).write_text(digest)
+        exported.append(build)
+
+    return exported
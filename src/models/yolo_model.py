@@ -1,10 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 
 import mlflow
 import wandb
 import yaml
 from ultralytics import YOLO
 
+from src.models.export import export_serving_builds
+
 
 class YOLOTrainer:
     def __init__(self, config_path):
@@ -55,20 +59,33 @@ class YOLOTrainer:
             for metric_name, metric_value in results.results_dict.items():
                 mlflow.log_metric(metric_name, metric_value)
 
-            # Save and log model
-            self.model.export(format="onnx")  # Export to ONNX for optimization
+            # Save and log model. Export loads its own copy of the model, so
+            # the upload overlaps it; MLflow calls stay on this thread, which
+            # owns the active run
+            best_path = Path(results.save_dir) / "weights" / "best.pt"
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                export_future = pool.submit(self.export, best_path)
 
-            mlflow.pytorch.log_model(
-                pytorch_model=self.model.model,
-                artifact_path="model",
-                registered_model_name=self.config["model"]["name"],
-            )
+                # Register the best.pt Ultralytics already wrote instead of
+                # re-pickling the live module
+                mlflow.log_artifact(str(best_path), artifact_path="model")
+                run_id = mlflow.active_run().info.run_id
+                mlflow.register_model(
+                    f"runs:/{run_id}/model", self.config["model"]["name"]
+                )
+
+                # The exported builds land in project_dir, so wait for them
+                export_future.result()
 
             # Log artifacts
             mlflow.log_artifacts(self.config["output"]["project_dir"])
 
             return results
 
+    def export(self, weights):
+        """Export serving builds next to weights: TensorRT on GPU, OpenVINO for CPU"""
+        return export_serving_builds(Path(weights), self.config)
+
     def evaluate(self, test_data_path):
         metrics = self.model.val(data=test_data_path)
         return metrics
@@ -0,0 +1,72 @@
+import os
+
+import mlflow
+import torch
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import SETTINGS
+
+
+def on_fit_epoch_end(trainer):
+    """Callback to log metrics after each epoch"""
+    # Under DDP every rank runs callbacks; only rank 0 writes to MLflow
+    if int(os.environ.get("RANK", 0)) != 0:
+        return
+
+    metrics = trainer.metrics
+    epoch = trainer.epoch
+    # One request per epoch instead of one per metric
+    epoch_metrics = {}
+
+    # Log training losses
+    if hasattr(trainer, "loss_items"):
+        # A single device-to-host copy rather than a sync per loss term. It stays
+        # blocking: tolist() reads the host buffer straight away, so a
+        # non_blocking copy would have to be synchronized right after anyway
+        box_loss, cls_loss, dfl_loss = trainer.loss_items.detach().cpu().tolist()[:3]
+        epoch_metrics["train/box_loss"] = box_loss
+        epoch_metrics["train/cls_loss"] = cls_loss
+        epoch_metrics["train/dfl_loss"] = dfl_loss
+
+    # Log validation metrics
+    if metrics:
+        # Materialize any tensor/numpy values in one pass before picking keys
+        metrics = {k: float(v) for k, v in metrics.items()}
+        epoch_metrics["metrics/mAP50"] = metrics.get("metrics/mAP50(B)", 0.0)
+        epoch_metrics["metrics/mAP50-95"] = metrics.get("metrics/mAP50-95(B)", 0.0)
+
+    if epoch_metrics:
+        mlflow.log_metrics(epoch_metrics, step=epoch, synchronous=False)
+
+
+def on_pretrain_routine_end(trainer):
+    """Callback to move the training model to channels-last before the first step"""
+    # DDP has already bucketed the gradients by parameter layout at this point
+    if trainer.world_size > 1:
+        return
+    # NHWC lets cuDNN pick tensor-core convolution kernels; EMA follows suit
+    trainer.model.to(memory_format=torch.channels_last)
+    if trainer.ema:
+        trainer.ema.ema.to(memory_format=torch.channels_last)
+
+
+class CallbackDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer that installs this project's callbacks and backend flags"""
+
+    # Ultralytics' DDP launcher rebuilds the trainer in each rank from its class
+    # path with only the default callbacks, so anything added via
+    # YOLO.add_callback or set in the parent process never reaches the ranks.
+    # Doing it here covers single-GPU and DDP runs alike.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Ultralytics rebuilds the model in _setup_train, so convert it after that
+        self.add_callback("on_pretrain_routine_end", on_pretrain_routine_end)
+        # Ultralytics' built-in MLflow callback already logs the same losses and
+        # mAPs each epoch; only add ours when that integration is switched off
+        if not SETTINGS.get("mlflow", False):
+            self.add_callback("on_fit_epoch_end", on_fit_epoch_end)
+
+        # Let the FP32 matmuls/convs that autocast leaves alone use TF32 cores
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        # imgsz is fixed for the run, so cuDNN's autotuned kernels stay valid
+        torch.backends.cudnn.benchmark = True
@@ -1,40 +1,54 @@
 import argparse
+import copy
+import os
 import shutil
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 import mlflow
-import mlflow.pytorch
 import torch
 import yaml
 from ultralytics import YOLO
 
+from src.models.export import export_serving_builds
+from src.training.callbacks import CallbackDetectionTrainer
 
-def on_fit_epoch_end(trainer):
-    """Callback to log metrics after each epoch"""
-    metrics = trainer.metrics
-    epoch = trainer.epoch
+try:
+    # libyaml-backed parser; the pure-Python one is an order of magnitude slower
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
-    # Log training losses
-    if hasattr(trainer, "loss_items"):
-        mlflow.log_metric("train/box_loss", float(trainer.loss_items[0]), step=epoch)
-        mlflow.log_metric("train/cls_loss", float(trainer.loss_items[1]), step=epoch)
-        mlflow.log_metric("train/dfl_loss", float(trainer.loss_items[2]), step=epoch)
 
-    # Log validation metrics
-    if metrics:
-        mlflow.log_metric(
-            "metrics/mAP50", float(metrics.get("metrics/mAP50(B)", 0)), step=epoch
-        )
-        mlflow.log_metric(
-            "metrics/mAP50-95", float(metrics.get("metrics/mAP50-95(B)", 0)), step=epoch
-        )
+@lru_cache(maxsize=None)
+def _parse_yaml(path: str):
+    with open(path, "r") as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def load_config(path: str):
+    """Parse a YAML config once per path and hand out independent copies"""
+    return copy.deepcopy(_parse_yaml(path))
+
+
+def promote_checkpoint(src: Path, dst: Path):
+    """Replace dst with src, hard-linking when both are on the same filesystem"""
+    # Staged next to dst and renamed over it, so dst is never half-written
+    staged = dst.with_name(dst.name + ".tmp")
+    staged.unlink(missing_ok=True)
+    try:
+        # Nothing writes to a finished run's weights, so sharing the inode is safe
+        os.link(src, staged)
+    except OSError:
+        # Cross-device or no hard-link support; copyfile uses sendfile on Linux
+        shutil.copyfile(src, staged)
+    os.replace(staged, dst)
 
 
 class YOLOTrainer:
     def __init__(self, config_path: str):
-        with open(config_path, "r") as f:
-            self.config = yaml.safe_load(f)
+        self.config = load_config(config_path)
 
         init_weights = Path("src/models/best.pt")
         arch = self.config["model"]["architecture"]
@@ -46,42 +60,104 @@ class YOLOTrainer:
             self.model = YOLO(arch)
             print(f"Using architecture: {arch}")
 
+        # torch.compile (Inductor) needs PyTorch 2.x and a CUDA device
+        self.compile = self.config["training"].get("compile", False)
+        compile_supported = hasattr(torch, "compile") and torch.cuda.is_available()
+        if self.compile and not compile_supported:
+            print("⚠️ torch.compile unavailable on this host, training in eager mode")
+            self.compile = False
+
+    def _train_device(self):
+        # DDP across every visible GPU; batch_size is the global batch, which
+        # Ultralytics shards across ranks
+        gpu_count = torch.cuda.device_count()
+        if self.config["training"].get("ddp", False) and gpu_count > 1:
+            return list(range(gpu_count))
+        return self.config["device"]
+
+    def _validate(self, model):
+        # Rectangular batches pad less than square 640 letterboxes. Each val()
+        # builds a fresh dataset, so caching would only add a full pre-read.
+        # Rect batch shapes vary, and cuDNN autotuning every new one costs more
+        # than it saves over a single pass, so benchmark mode is off meanwhile
+        benchmark = torch.backends.cudnn.benchmark
+        torch.backends.cudnn.benchmark = False
+        try:
+            return model.val(
+                data=self.config["data"]["yaml_path"],
+                rect=True,
+                half=True,
+                batch=32,
+            )
+        finally:
+            torch.backends.cudnn.benchmark = benchmark
+
     def train(self):
+        # Queue every MLflow write, Ultralytics' callback included, on a background
+        # thread so a slow tracking server doesn't stall training. Newer MLflow
+        # only; 2.8 has no mlflow.config and just the per-call synchronous flag
+        enable_async_logging = getattr(
+            getattr(mlflow, "config", None), "enable_async_logging", None
+        )
+        if enable_async_logging is not None:
+            enable_async_logging(True)
+
         init_val_score = None
         init_weights = Path("src/models/best.pt")
 
         # ✅ Step 1: Evaluate the initial checkpoint if it exists
         if init_weights.exists():
             print("Evaluating initial checkpoint before training...")
-            init_metrics = self.model.val(data=self.config["data"]["yaml_path"])
+            init_metrics = self._validate(self.model)
             init_val_score = init_metrics.box.map
             print(f"Initial checkpoint mAP50-95: {init_val_score:.4f}")
 
+        # Ultralytics keeps workers alive across epochs and pins host memory;
+        # cache="ram" falls back to disk reads if the dataset won't fit
+        loader_cfg = self.config["training"].get("dataloader", {})
+        train_kwargs = {
+            "workers": loader_cfg.get("workers", min(8, os.cpu_count() or 1)),
+            "cache": loader_cfg.get("cache", "ram"),
+            "rect": loader_cfg.get("rect", False),
+        }
+        if self.compile:
+            # Ultralytics compiles the training model only; val() stays eager
+            train_kwargs["compile"] = self.compile
+
         try:
             # Directly train with log_mlflow enabled for automatic MLflow logging
             results = self.model.train(
+                # Carries our callbacks into every DDP rank, unlike add_callback
+                trainer=CallbackDetectionTrainer,
                 data=self.config["data"]["yaml_path"],
                 epochs=self.config["training"]["epochs"],
                 batch=self.config["training"]["batch_size"],
                 imgsz=self.config["model"]["img_size"],
                 lr0=self.config["training"]["learning_rate"],
-                device=self.config["device"],
+                device=self._train_device(),
                 project=self.config["output"]["project_dir"],
                 name=f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
                 save=True,
                 val=True,
+                amp=self.config["training"].get("amp", True),
+                **train_kwargs,
             )
 
             # ✅ Step 3: Locate the new best.pt
-            new_best_path = Path(results.save_dir) / "weights" / "best.pt"
+            # The DDP launcher process gets no metrics back, only the trainer state
+            save_dir = Path(self.model.trainer.save_dir)
+            new_best_path = save_dir / "weights" / "best.pt"
             final_best_path = Path("src/models/best.pt")
 
             new_val_score = None
             if new_best_path.exists():
-                # Evaluate the new best model
-                new_model = YOLO(str(new_best_path))
-                new_metrics = new_model.val(data=self.config["data"]["yaml_path"])
-                new_val_score = new_metrics.box.map
+                # Ultralytics already validated best.pt at the end of training
+                results_dict = getattr(results, "results_dict", {})
+                new_val_score = results_dict.get("metrics/mAP50-95(B)")
+                if new_val_score is None:
+                    # Older Ultralytics releases may not report it; evaluate directly
+                    new_metrics = self._validate(YOLO(str(new_best_path)))
+                    new_val_score = new_metrics.box.map
                 print(f"\nNew best mAP50-95: {new_val_score:.4f}")
 
             # ✅ Step 4: Compare and decide which to keep
@@ -89,7 +165,7 @@ class YOLOTrainer:
                 init_val_score is None or new_val_score >= init_val_score
             ):
                 # New model is better or no init checkpoint
-                shutil.copy(new_best_path, final_best_path)
+                promote_checkpoint(new_best_path, final_best_path)
                 print(
                     f"✅ Replaced global best.pt with new model ({new_val_score:.4f})"
                 )
@@ -100,19 +176,33 @@ class YOLOTrainer:
                     better: {init_val_score:.4f})"
                 )
 
+            # ✅ Step 5: Export serving builds of the chosen best.pt into src/models,
+            # where the API looks for them; builds already made from it are kept
+            if final_best_path.exists():
+                try:
+                    for build in export_serving_builds(final_best_path, self.config):
+                        print(f"✅ Serving build ready: {build}")
+                except Exception as e:
+                    # The API falls back to best.pt without an up-to-date build
+                    print(f"⚠️ Export failed, serving will use best.pt: {e}")
+
             # Log the chosen best.pt file to MLflow
             try:
-                mlflow.pytorch.log_model(
-                    pytorch_model=torch.load(final_best_path)[
-                        "model"
-                    ],  # load final chosen model
-                    artifact_path="model",
-                    registered_model_name=self.config["model"]["name"],
+                # Upload and register the checkpoint bytes as they are rather than
+                # unpickling the model just to have MLflow pickle it again
+                mlflow.log_artifact(str(final_best_path), artifact_path="model")
+                run_id = mlflow.active_run().info.run_id
+                mlflow.register_model(
+                    f"runs:/{run_id}/model", self.config["model"]["name"]
                 )
                 print("✅ Final model logged to MLflow.")
             except Exception as e:
                 print(f"Failed to log model: {e}")
 
+            # Don't return before queued metrics have reached the server
+            if hasattr(mlflow, "flush_async_logging"):
+                mlflow.flush_async_logging()
+
             return results
 
         except Exception as e:
@@ -121,7 +211,8 @@ class YOLOTrainer:
             raise
 
     def evaluate(self):
-        return self.model.val(data=self.config["data"]["yaml_path"])
+        # BaseValidator.__call__ already runs under smart_inference_mode
+        return self._validate(self.model)
 
 
 if __name__ == "__main__":
@@ -132,9 +223,19 @@ if __name__ == "__main__":
         required=True,
         help="Path to the training configuration YAML file",
     )
+    parser.add_argument(
+        "--final-eval",
+        action="store_true",
+        help="Run another validation pass after training",
+    )
     args = parser.parse_args()
 
     trainer = YOLOTrainer(config_path=args.config)
     train_results = trainer.train()
-    val_metrics = trainer.evaluate()
-    print(f"Validation mAP50-95: {val_metrics.box.map:.4f}")
+    if args.final_eval:
+        val_metrics = trainer.evaluate()
+    else:
+        # Ultralytics already validated best.pt once training finished
+        val_metrics = train_results
+    if val_metrics is not None:
+        print(f"Validation mAP50-95: {val_metrics.box.map:.4f}")
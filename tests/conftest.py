@@ -0,0 +1,39 @@
+import io
+from pathlib import Path
+
+import av
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from api.main import app
+
+
+# Entering the TestClient runs the app lifespan, which loads the detector once
+# for the whole session
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+# Read the sample upload from disk once; tests wrap it in a fresh BytesIO
+@pytest.fixture(scope="session")
+def sample_image_bytes():
+    return Path("assets/sample.jpg").read_bytes()
+
+
+# A short synthetic 12-frame, 24 fps clip, small enough to run through the model
+@pytest.fixture(scope="session")
+def sample_video_bytes():
+    buf = io.BytesIO()
+    with av.open(buf, mode="w", format="mp4") as container:
+        stream = container.add_stream("mpeg4", rate=24)
+        stream.width, stream.height = 320, 240
+        stream.pix_fmt = "yuv420p"
+        for i in range(12):
+            pixels = np.full((240, 320, 3), i * 20, dtype=np.uint8)
+            frame = av.VideoFrame.from_ndarray(pixels, format="rgb24")
+            container.mux(stream.encode(frame))
+        container.mux(stream.encode())
+    return buf.getvalue()
@@ -1,13 +1,11 @@
-from fastapi.testclient import TestClient
+import io
 
-from api.main import app
-
-# Create a TestClient instance that will interact with your app
-client = TestClient(app)
+import pytest
+from PIL import Image
 
 
 # Test for the root endpoint, which serves the HTML page.
-def test_read_root():
+def test_read_root(client):
     """
     Tests if the root endpoint ('/') returns a successful response and HTML content.
     """
@@ -17,7 +15,7 @@ def test_read_root():
 
 
 # Test for the health check endpoint.
-def test_health_check():
+def test_health_check(client):
     """
     Tests the /health endpoint to ensure the API reports a healthy status.
     """
@@ -29,14 +27,13 @@ def test_health_check():
 
 
 # Test for the main image prediction endpoint.
-def test_predict_endpoint():
+def test_predict_endpoint(client, sample_image_bytes):
     """
     Tests the /predict endpoint by sending a mock image file.
     Verifies the status code and the structure of the JSON response.
     """
-    with open("assets/sample.jpg", "rb") as f:
-        mock_file = ("sample.jpg", f, "image/jpeg")
-        response = client.post("/api/predict", files={"file": mock_file})
+    mock_file = ("sample.jpg", io.BytesIO(sample_image_bytes), "image/jpeg")
+    response = client.post("/api/predict", files={"file": mock_file})
 
     # 1. Assert that the request was successful
     assert response.status_code == 200
@@ -56,7 +53,88 @@ def test_predict_endpoint():
     assert isinstance(json_response["image_size"], list)
 
 
-def test_predict_endpoint_no_file():
+# Large JPEGs are decoded at a reduced scale but reported at full size.
+@pytest.mark.parametrize("orientation", [1, 6])
+def test_predict_endpoint_large_jpeg(client, sample_image_bytes, orientation):
+    """
+    Tests that /predict reports the original size of a large JPEG, honouring
+    EXIF rotation, and returns boxes in that image's coordinates.
+    """
+    with Image.open(io.BytesIO(sample_image_bytes)) as img:
+        large = img.convert("RGB").resize((img.width * 4, img.height * 4))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buf = io.BytesIO()
+    large.save(buf, format="JPEG", exif=exif)
+
+    mock_file = ("large.jpg", io.BytesIO(buf.getvalue()), "image/jpeg")
+    response = client.post("/api/predict", files={"file": mock_file})
+    assert response.status_code == 200
+
+    json_response = response.json()
+    width, height = large.size
+    if orientation == 6:
+        # Rotated 90 degrees on decode
+        width, height = height, width
+    assert json_response["image_size"] == [width, height]
+    for detection in json_response["detections"]:
+        x1, y1, x2, y2 = detection["bbox"]
+        assert -1 <= x1 <= x2 <= width + 1
+        assert -1 <= y1 <= y2 <= height + 1
+
+
+# Test for batched prediction over several uploads.
+def test_batch_predict_endpoint(client, sample_image_bytes):
+    """
+    Tests that /batch_predict returns one result per uploaded file, in order.
+    """
+    files = [
+        ("files", (name, io.BytesIO(sample_image_bytes), "image/jpeg"))
+        for name in ("first.jpg", "second.jpg")
+    ]
+    response = client.post("/api/batch_predict", files=files)
+    assert response.status_code == 200
+
+    results = response.json()["results"]
+    assert [r["filename"] for r in results] == ["first.jpg", "second.jpg"]
+    for result in results:
+        assert isinstance(result["detections"], list)
+        assert result["num_objects"] == len(result["detections"])
+
+
+# Test for the video endpoint and its frame stride.
+def test_predict_video_stride(client, sample_video_bytes):
+    """
+    Tests that stride=2 runs detection on every other frame and halves the
+    reported fps, and that stride=0 is rejected.
+    """
+
+    def post(**params):
+        mock_file = ("clip.mp4", io.BytesIO(sample_video_bytes), "video/mp4")
+        return client.post(
+            "/api/predict_video", files={"file": mock_file}, params=params
+        )
+
+    assert post(stride=0).status_code == 422
+
+    every_frame = post().json()
+    every_other = post(stride=2).json()
+    assert len(every_frame["video_detections"]) == 12
+    assert len(every_other["video_detections"]) == 6
+    assert every_other["fps"] == pytest.approx(every_frame["fps"] / 2)
+
+
+# Test that uploads the decoder can't read are rejected as bad requests.
+def test_predict_video_invalid_upload(client):
+    """
+    Tests that /predict_video answers a non-video upload with a 400 error.
+    """
+    mock_file = ("clip.mp4", io.BytesIO(b"not a video"), "video/mp4")
+    response = client.post("/api/predict_video", files={"file": mock_file})
+    assert response.status_code == 400
+
+
+def test_predict_endpoint_no_file(client):
     """
     Tests that the API correctly handles requests with no file sent.
     It should return a 422 Unprocessable Entity error.
@@ -66,7 +144,7 @@ def test_predict_endpoint_no_file():
 
 
 # A basic test for the Prometheus metrics endpoint.
-def test_metrics_endpoint():
+def test_metrics_endpoint(client):
     """
     Tests that the /metrics endpoint returns a successful response
     and that the content type is plain text.